@@ -2,8 +2,13 @@ from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import LETTER
 
 def page(c, y, lines):
-    for i, t in enumerate(lines):
-        c.drawString(72, y-16*i, t)
+    # one BT/ET text block instead of a drawString per line
+    t = c.beginText(72, y)
+    t.setFont("Helvetica", 11)
+    t.setLeading(16)
+    for line in lines:
+        t.textLine(line)
+    c.drawText(t)
 
 c = canvas.Canvas("output/smoke-test.pdf", pagesize=LETTER)
 c.setFont("Helvetica", 11)
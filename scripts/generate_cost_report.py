@@ -4,6 +4,7 @@
 import json
 import pathlib
 import argparse
+from collections import defaultdict
 from scripts.parse_with_openai import load_quotes, group_key, estimate_tokens_and_cost, DEFAULT_PROMPT
 
 def generate_cost_report(jsonl_path: pathlib.Path, output_path: pathlib.Path, model: str = 'gpt-5-mini'):
@@ -15,16 +16,20 @@ def generate_cost_report(jsonl_path: pathlib.Path, output_path: pathlib.Path, mo
         return
     
     # Group quotes
-    groups = {}
+    groups = defaultdict(list)
     for q in quotes:
-        key = group_key(q)
-        if key not in groups:
-            groups[key] = []
-        groups[key].append(q)
-    
-    # Estimate costs
-    estimate = estimate_tokens_and_cost(model, groups, DEFAULT_PROMPT)
+        groups[group_key(q)].append(q)
     
+    # One estimate pass returns both totals and the per-group breakdown
+    estimate = estimate_tokens_and_cost(model, groups, DEFAULT_PROMPT,
+                                        cache_path=jsonl_path.parent / '.tokcache.json')
+    group_records = [{
+        'name': g['name'],
+        'quote_count': g['quote_count'],
+        'estimated_tokens': g['input_tokens'] + g['output_tokens'],
+        'estimated_cost': g['usd_total']
+    } for g in estimate.pop('per_group')]
+
     # Generate report
     report = {
         'model': model,
@@ -38,19 +43,9 @@ def generate_cost_report(jsonl_path: pathlib.Path, output_path: pathlib.Path, mo
             'usd_output': estimate['usd_output'],
             'usd_total': estimate['usd_total']
         },
-        'groups': []
+        'groups': group_records
     }
-    
-    # Add group details
-    for key, items in groups.items():
-        group_estimate = estimate_tokens_and_cost(model, {key: items}, DEFAULT_PROMPT)
-        report['groups'].append({
-            'name': key,
-            'quote_count': len(items),
-            'estimated_tokens': group_estimate['input_tokens'] + group_estimate['output_tokens'],
-            'estimated_cost': group_estimate['usd_total']
-        })
-    
+
     # Write report
     with open(output_path, 'w', encoding='utf-8') as f:
         json.dump(report, f, indent=2, ensure_ascii=False)
@@ -6,37 +6,47 @@ import csv
 import pathlib
 import argparse
 
+# Try to import orjson for fast JSONL parsing
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+def _row(quote: dict) -> tuple:
+    """Extract one CSV row from a quote record."""
+    tags = quote.get('tags', [])
+    full_quote = quote.get('quote', '')
+    preview = full_quote if len(full_quote) <= 80 else full_quote[:80] + '...'
+    return (quote.get('page_start', 0), quote.get('page_end', 0),
+            quote.get('category', 'unknown'), tags[0] if tags else 'untagged',
+            preview, full_quote)
+
 def generate_csv_index(jsonl_path: pathlib.Path, output_path: pathlib.Path):
     """Generate CSV index from scan_quotes.jsonl."""
-    quotes = []
-    
-    with open(jsonl_path, 'r', encoding='utf-8') as f:
-        for line in f:
-            line = line.strip()
-            if not line:
+    # Stream JSONL straight into the CSV writer — one pass, no quote list
+    count = 0
+    batch = []
+    with open(jsonl_path, 'rb') as in_f, \
+         open(output_path, 'w', newline='', encoding='utf-8', buffering=1 << 20) as out_f:
+        writer = csv.writer(out_f)
+        writer.writerow(['page_start', 'page_end', 'category', 'top_tag', 'preview', 'full_quote'])
+
+        for line in in_f:
+            if not line or line == b'\n':
                 continue
             try:
-                quote = json.loads(line)
-                quotes.append(quote)
-            except json.JSONDecodeError:
+                quote = _json_loads(line)
+            except Exception:
                 continue
-    
-    with open(output_path, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerow(['page_start', 'page_end', 'category', 'top_tag', 'preview', 'full_quote'])
-        
-        for quote in quotes:
-            page_start = quote.get('page_start', 0)
-            page_end = quote.get('page_end', 0)
-            category = quote.get('category', 'unknown')
-            tags = quote.get('tags', [])
-            top_tag = tags[0] if tags else 'untagged'
-            full_quote = quote.get('quote', '')
-            preview = full_quote[:80] + '...' if len(full_quote) > 80 else full_quote
-            
-            writer.writerow([page_start, page_end, category, top_tag, preview, full_quote])
-    
-    print(f"Generated CSV index with {len(quotes)} quotes → {output_path}")
+            batch.append(_row(quote))
+            count += 1
+            if len(batch) >= 1024:
+                writer.writerows(batch)
+                batch.clear()
+        writer.writerows(batch)
+
+    print(f"Generated CSV index with {count} quotes → {output_path}")
 
 def main():
     ap = argparse.ArgumentParser()
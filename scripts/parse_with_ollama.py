@@ -1,6 +1,14 @@
-import argparse, json, pathlib, subprocess, re
+import argparse, hashlib, json, pathlib, re
 from typing import List, Dict
 from collections import defaultdict
+import requests
+
+# Try to import orjson for fast JSONL parsing
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
 
 DEFAULT_PROMPT = """
 ROLE: Quote‑only compiler.
@@ -26,62 +34,84 @@ def group_key(quote: Dict) -> str:
     lead_tag = tags[0] if tags else 'untagged'
     return f"{cat} × {lead_tag}"
 
+# Precompiled patterns for split_sections and slugify (hot per-group paths)
+_RE_COMP = re.compile(r"\bCOMPILATIONS\b.*?```(.*?)```", re.I | re.S)
+_RE_SNIP = re.compile(r"\bSNIPPETS\b.*?```(.*?)```", re.I | re.S)
+_RE_SPLIT = re.compile(r"^\s*SNIPPETS\s*$", re.I | re.M)
+_RE_COMP_HDR = re.compile(r"^\s*COMPILATIONS\s*", re.I | re.M)
+# Single-pass byte translation for slugs: lowercase ASCII alphanumerics pass
+# through, everything else folds to '-'
+_SLUG_TABLE = bytes(c if (48 <= c <= 57 or 97 <= c <= 122) else ord('-') for c in range(256))
+
 def slugify(text: str) -> str:
     """Convert text to a URL-safe slug."""
-    return re.sub(r"[^a-z0-9]+", "-", text.lower()).strip('-') or 'untagged'
+    slug = text.lower().encode('ascii', 'replace').translate(_SLUG_TABLE).decode('ascii')
+    while '--' in slug:
+        slug = slug.replace('--', '-')
+    return slug.strip('-') or 'untagged'
+
+def quote_line(q: Dict) -> str:
+    """Format one quote as its input-block line ('' when the quote is empty)."""
+    qt = q['_quote'] if '_quote' in q else (q.get('quote') or '').strip()
+    if not qt:
+        return ''
+    return f"[p.{q.get('page_start', 0)}-{q.get('page_end', 0)}] \n{qt}"
 
 def build_input_block(quotes: List[Dict]) -> str:
     """Build the input block for the prompt from quotes."""
-    lines = []
-    for q in quotes:
-        pstart = q.get('page_start', 0)
-        pend = q.get('page_end', 0)
-        qt = q.get('quote', '').strip()
-        if qt:
-            lines.append(f"[p.{pstart}-{pend}] \n{qt}")
-    return "\n\n".join(lines)
+    return "\n\n".join(line for line in map(quote_line, quotes) if line)
 
 def split_sections(text: str) -> Dict[str, str]:
     """Extract COMPILATIONS and SNIPPETS sections from response."""
     comp = ""
     snip = ""
     # Try to find fenced blocks first
-    m_comp = re.search(r"(?is)\bCOMPILATIONS\b.*?```(.*?)```", text)
-    m_snip = re.search(r"(?is)\bSNIPPETS\b.*?```(.*?)```", text)
+    m_comp = _RE_COMP.search(text)
+    m_snip = _RE_SNIP.search(text)
     if m_comp: comp = m_comp.group(1).strip()
     if m_snip: snip = m_snip.group(1).strip()
     # Fallback: split by headers without fences
     if not comp or not snip:
-        parts = re.split(r"(?im)^\s*SNIPPETS\s*$", text, maxsplit=1)
+        parts = _RE_SPLIT.split(text, maxsplit=1)
         if len(parts) == 2:
             comp_alt, snip_alt = parts[0], parts[1]
             # Remove leading 'COMPILATIONS' label if present
-            comp_alt = re.sub(r"(?im)^\s*COMPILATIONS\s*", "", comp_alt).strip()
+            comp_alt = _RE_COMP_HDR.sub("", comp_alt).strip()
             if not comp: comp = comp_alt
             if not snip: snip = snip_alt.strip()
     return { 'compilations': comp.strip(), 'snippets': snip.strip() }
 
 
-def load_quotes(jsonl_path: pathlib.Path) -> List[dict]:
-    quotes = []
-    with open(jsonl_path, 'r', encoding='utf-8') as f:
+def iter_quotes(jsonl_path: pathlib.Path):
+    """Yield quote records one at a time without materializing the whole file."""
+    with open(jsonl_path, 'rb') as f:
         for line in f:
-            line = line.strip()
-            if not line:
+            if not line or line == b'\n':
                 continue
             try:
-                quotes.append(json.loads(line))
+                q = _json_loads(line)
             except Exception:
-                pass
-    return quotes
+                continue
+            # Strip once at ingest so per-group formatting skips it
+            q['_quote'] = (q.get('quote') or '').strip()
+            yield q
+
+
+def load_quotes(jsonl_path: pathlib.Path) -> List[dict]:
+    return list(iter_quotes(jsonl_path))
 
 
-def run_ollama(ollama_cmd: str, model: str, prompt: str) -> str:
-    # prefer `ollama run MODEL -p PROMPT`
+def run_ollama(session: requests.Session, base_url: str, model: str, prompt: str) -> str:
+    # HTTP API over a persistent session; keep_alive keeps the model resident
+    # across groups instead of reloading it per `ollama run` invocation
     try:
-        res = subprocess.run([ollama_cmd, 'run', model, '-p', prompt], capture_output=True, text=True, check=True)
-        return res.stdout
-    except (subprocess.CalledProcessError, FileNotFoundError) as e:
+        r = session.post(f"{base_url.rstrip('/')}/api/generate",
+                         json={'model': model, 'prompt': prompt,
+                               'stream': False, 'keep_alive': '30m'},
+                         timeout=600)
+        r.raise_for_status()
+        return r.json().get('response', '')
+    except requests.RequestException as e:
         raise SystemExit(f"Failed to run Ollama: {e}")
 
 
@@ -90,21 +120,19 @@ def main():
     ap.add_argument('-i','--input', required=True, help='scan_quotes.jsonl path')
     ap.add_argument('-m','--model', default='llama3.2')
     ap.add_argument('-o','--outdir', required=True)
-    ap.add_argument('-ollama','--ollama', default='ollama')
+    ap.add_argument('--ollama-url', default='http://127.0.0.1:11434', help='Ollama server base URL')
     args = ap.parse_args()
 
     jsonl = pathlib.Path(args.input)
     outdir = pathlib.Path(args.outdir)
     outdir.mkdir(parents=True, exist_ok=True)
 
-    quotes = load_quotes(jsonl)
-    if not quotes:
-        raise SystemExit('No quotes found in JSONL.')
-
     # Group by category + lead tag for batching
     groups: Dict[str, List[Dict]] = defaultdict(list)
-    for q in quotes:
+    for q in iter_quotes(jsonl):
         groups[group_key(q)].append(q)
+    if not groups:
+        raise SystemExit('No quotes found in JSONL.')
 
     comp_dir = outdir / 'compilations'
     snip_dir = outdir / 'snippets'
@@ -112,12 +140,19 @@ def main():
     snip_dir.mkdir(exist_ok=True)
 
     index_lines = ["# Quote Bundles\n"]
+    session = requests.Session()
+    seen_outputs: Dict[str, str] = {}  # body hash -> model output
 
     for key, items in groups.items():
         slug = slugify(key)
         body = build_input_block(items)
-        prompt = DEFAULT_PROMPT + "\n\nINPUT QUOTES:\n\n" + body
-        out = run_ollama(args.ollama, args.model, prompt)
+        # Identical bodies produce identical prompts — run each body once
+        h = hashlib.blake2b(body.encode('utf-8'), digest_size=16).hexdigest()
+        out = seen_outputs.get(h)
+        if out is None:
+            prompt = DEFAULT_PROMPT + "\n\nINPUT QUOTES:\n\n" + body
+            out = run_ollama(session, args.ollama_url, args.model, prompt)
+            seen_outputs[h] = out
         sections = split_sections(out)
 
         comp_path = comp_dir / f"{slug}.md"
@@ -1,8 +1,16 @@
-import argparse, json, pathlib, re
+import argparse, functools, hashlib, json, pathlib, random, re, time
 from typing import List, Dict
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import OpenAI, RateLimitError
+
+# Try to import orjson for fast JSONL parsing
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
 
 # Pricing rates per million tokens (input, output)
 RATES = {
@@ -25,18 +33,22 @@ MANDATES:
 - Keep outputs deterministic and tidy.
 """.strip()
 
-def load_quotes(jsonl_path: pathlib.Path) -> List[dict]:
-    quotes = []
-    with open(jsonl_path, 'r', encoding='utf-8') as f:
+def iter_quotes(jsonl_path: pathlib.Path):
+    """Yield quote records one at a time without materializing the whole file."""
+    with open(jsonl_path, 'rb') as f:
         for line in f:
-            line = line.strip()
-            if not line:
+            if not line or line == b'\n':
                 continue
             try:
-                quotes.append(json.loads(line))
+                q = _json_loads(line)
             except Exception:
-                pass
-    return quotes
+                continue
+            # Strip once at ingest so per-group formatting skips it
+            q['_quote'] = (q.get('quote') or '').strip()
+            yield q
+
+def load_quotes(jsonl_path: pathlib.Path) -> List[dict]:
+    return list(iter_quotes(jsonl_path))
 
 def group_key(quote: Dict) -> str:
     """Create a grouping key from category and first tag."""
@@ -45,77 +57,91 @@ def group_key(quote: Dict) -> str:
     lead_tag = tags[0] if tags else 'untagged'
     return f"{cat} × {lead_tag}"
 
+# Precompiled patterns for split_sections and slugify (hot per-group paths)
+_RE_COMP = re.compile(r"\bCOMPILATIONS\b.*?```(.*?)```", re.I | re.S)
+_RE_SNIP = re.compile(r"\bSNIPPETS\b.*?```(.*?)```", re.I | re.S)
+_RE_SPLIT = re.compile(r"^\s*SNIPPETS\s*$", re.I | re.M)
+_RE_COMP_HDR = re.compile(r"^\s*COMPILATIONS\s*", re.I | re.M)
+# Single-pass byte translation for slugs: lowercase ASCII alphanumerics pass
+# through, everything else folds to '-'
+_SLUG_TABLE = bytes(c if (48 <= c <= 57 or 97 <= c <= 122) else ord('-') for c in range(256))
+
+def slugify(text: str) -> str:
+    """Convert text to a URL-safe slug."""
+    slug = text.lower().encode('ascii', 'replace').translate(_SLUG_TABLE).decode('ascii')
+    while '--' in slug:
+        slug = slug.replace('--', '-')
+    return slug.strip('-') or 'untagged'
+
+def quote_line(q: Dict) -> str:
+    """Format one quote as its input-block line ('' when the quote is empty)."""
+    qt = q['_quote'] if '_quote' in q else (q.get('quote') or '').strip()
+    if not qt:
+        return ''
+    return f"[p.{q.get('page_start', 0)}-{q.get('page_end', 0)}] \n{qt}"
+
 def build_input_block(quotes: List[Dict]) -> str:
     """Build the input block for the prompt from quotes."""
-    lines = []
-    for q in quotes:
-        pstart = q.get('page_start', 0)
-        pend = q.get('page_end', 0)
-        qt = q.get('quote', '').strip()
-        if qt:
-            lines.append(f"[p.{pstart}-{pend}] \n{qt}")
-    return "\n\n".join(lines)
+    return "\n\n".join(line for line in map(quote_line, quotes) if line)
 
 def split_sections(text: str) -> Dict[str, str]:
     """Extract COMPILATIONS and SNIPPETS sections from response."""
     comp = ""
     snip = ""
     # Try to find fenced blocks first
-    m_comp = re.search(r"(?is)\bCOMPILATIONS\b.*?```(.*?)```", text)
-    m_snip = re.search(r"(?is)\bSNIPPETS\b.*?```(.*?)```", text)
+    m_comp = _RE_COMP.search(text)
+    m_snip = _RE_SNIP.search(text)
     if m_comp: comp = m_comp.group(1).strip()
     if m_snip: snip = m_snip.group(1).strip()
     # Fallback: split by headers without fences
     if not comp or not snip:
-        parts = re.split(r"(?im)^\s*SNIPPETS\s*$", text, maxsplit=1)
+        parts = _RE_SPLIT.split(text, maxsplit=1)
         if len(parts) == 2:
             comp_alt, snip_alt = parts[0], parts[1]
             # Remove leading 'COMPILATIONS' label if present
-            comp_alt = re.sub(r"(?im)^\s*COMPILATIONS\s*", "", comp_alt).strip()
+            comp_alt = _RE_COMP_HDR.sub("", comp_alt).strip()
             if not comp: comp = comp_alt
             if not snip: snip = snip_alt.strip()
     return { 'compilations': comp.strip(), 'snippets': snip.strip() }
 
-def estimate_tokens(text: str) -> int:
-    """Estimate token count using tiktoken if available, fallback to heuristic."""
+@functools.lru_cache(maxsize=None)
+def get_encoder():
+    """Return a shared tiktoken encoder, or None when tiktoken is unavailable.
+
+    Building the encoder loads BPE merges from disk, so cache the instance
+    rather than reconstructing it per call.
+    """
     try:
         import tiktoken
-        enc = tiktoken.get_encoding("cl100k_base")
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        # tiktoken missing or unable to fetch its encoding data
+        return None
+
+def estimate_tokens(text: str, enc=None) -> int:
+    """Estimate token count using tiktoken if available, fallback to heuristic."""
+    if enc is None:
+        enc = get_encoder()
+    if enc is not None:
         return len(enc.encode(text))
-    except ImportError:
-        # Fallback: rough estimate of 4 chars per token
-        return len(text) // 4
+    # Fallback: rough estimate of 4 chars per token
+    return len(text) // 4
 
-def estimate_tokens_and_cost(model: str, groups: Dict[str, List[Dict]], prompt_template: str) -> Dict:
-    """Estimate tokens and cost for all groups."""
-    total_input_tokens = 0
-    total_output_tokens = 0
-    
-    for key, items in groups.items():
-        body = build_input_block(items)
-        full_prompt = prompt_template + "\n\nINPUT QUOTES:\n\n" + body
-        
-        input_tokens = estimate_tokens(full_prompt)
-        # Estimate output tokens (roughly 0.3x input for this task)
-        output_tokens = int(input_tokens * 0.3)
-        
-        total_input_tokens += input_tokens
-        total_output_tokens += output_tokens
-    
-    # Get pricing rates
+def summarize_cost(model: str, input_tokens: int, output_tokens: int) -> Dict:
+    """Build the cost-estimate record for a token total."""
     rates = RATES.get(model, (None, None))
     usd_input = None
     usd_output = None
     usd_total = None
-    
+
     if rates[0] is not None and rates[1] is not None:
-        usd_input = (total_input_tokens / 1_000_000) * rates[0]
-        usd_output = (total_output_tokens / 1_000_000) * rates[1]
+        usd_input = (input_tokens / 1_000_000) * rates[0]
+        usd_output = (output_tokens / 1_000_000) * rates[1]
         usd_total = usd_input + usd_output
-    
+
     return {
-        'input_tokens': total_input_tokens,
-        'output_tokens': total_output_tokens,
+        'input_tokens': input_tokens,
+        'output_tokens': output_tokens,
         'usd_input': usd_input,
         'usd_output': usd_output,
         'usd_total': usd_total,
@@ -123,29 +149,217 @@ def estimate_tokens_and_cost(model: str, groups: Dict[str, List[Dict]], prompt_t
         'usd_per_million_output': rates[1]
     }
 
-def run_compile(model: str, groups: Dict[str, List[Dict]], outdir: pathlib.Path):
-    client = OpenAI()
-    comp_dir = outdir / 'compilations'
-    snip_dir = outdir / 'snippets'
-    comp_dir.mkdir(exist_ok=True)
-    snip_dir.mkdir(exist_ok=True)
+def _quote_hash(line: str) -> str:
+    return hashlib.blake2b(line.encode('utf-8'), digest_size=8).hexdigest()
 
-    index_lines = ["# Quote Bundles (GPT)\n"]
+def load_token_cache(cache_path: pathlib.Path) -> Dict[str, int]:
+    """Load the per-quote token-count sidecar cache (empty on any problem)."""
+    try:
+        return json.loads(pathlib.Path(cache_path).read_text(encoding='utf-8'))
+    except Exception:
+        return {}
+
+def save_token_cache(cache_path: pathlib.Path, cache: Dict[str, int]):
+    """Atomically persist the token-count sidecar cache."""
+    cache_path = pathlib.Path(cache_path)
+    tmp = cache_path.with_suffix(cache_path.suffix + '.tmp')
+    tmp.write_text(json.dumps(cache), encoding='utf-8')
+    tmp.replace(cache_path)
+
+def group_body_tokens(items: List[Dict], enc, cache: Dict[str, int] = None) -> int:
+    """Token count for a group's input block, reusing cached per-quote counts."""
+    if enc is None:
+        return len(build_input_block(items)) // 4
+    lines = [line for line in (quote_line(q) for q in items) if line]
+    if not lines:
+        return 0
+    total = len(enc.encode("\n\n")) * (len(lines) - 1)
+    if cache is None:
+        # Tokenize all quote lines in one batched call
+        return total + sum(len(toks) for toks in enc.encode_batch(lines))
+    for line in lines:
+        h = _quote_hash(line)
+        n = cache.get(h)
+        if n is None:
+            cache[h] = n = len(enc.encode(line))
+        total += n
+    return total
+
+def estimate_tokens_and_cost(model: str, groups: Dict[str, List[Dict]], prompt_template: str,
+                             enc=None, cache_path: pathlib.Path = None) -> Dict:
+    """Estimate tokens and cost for all groups in one tokenizer pass.
+
+    The returned record carries a 'per_group' breakdown so callers never need
+    to re-estimate group by group. With cache_path set, per-quote token counts
+    persist across runs so only quotes new since the last run hit the encoder.
+    """
+    if enc is None:
+        enc = get_encoder()
+    # The prompt template is shared by every group — tokenize it once
+    prompt_tokens = estimate_tokens(prompt_template + "\n\nINPUT QUOTES:\n\n", enc)
+
+    cache = None
+    cached_before = 0
+    if cache_path is not None and enc is not None:
+        cache = load_token_cache(cache_path)
+        cached_before = len(cache)
+
+    total_input_tokens = 0
+    total_output_tokens = 0
+    per_group = []
 
     for key, items in groups.items():
-        slug = re.sub(r"[^a-z0-9]+","-", key.lower()).strip('-') or 'untagged'
-        body = build_input_block(items)
-        prompt = DEFAULT_PROMPT + "\n\nINPUT QUOTES:\n\n" + body
-        resp = client.responses.create(
-            model=model,
-            instructions=DEFAULT_PROMPT,
-            input=[{"role":"user","content":[{"type":"input_text","text":body}]}],
-            temperature=0.2,
-        )
-        out = resp.output_text
-        sections = split_sections(out)
+        input_tokens = prompt_tokens + group_body_tokens(items, enc, cache)
+        # Estimate output tokens (roughly 0.3x input for this task)
+        output_tokens = int(input_tokens * 0.3)
+
+        total_input_tokens += input_tokens
+        total_output_tokens += output_tokens
+        per_group.append({
+            'name': key,
+            'quote_count': len(items),
+            'input_tokens': input_tokens,
+            'output_tokens': output_tokens,
+            'usd_total': summarize_cost(model, input_tokens, output_tokens)['usd_total'],
+        })
+
+    if cache is not None and len(cache) != cached_before:
+        save_token_cache(cache_path, cache)
+
+    estimate = summarize_cost(model, total_input_tokens, total_output_tokens)
+    estimate['per_group'] = per_group
+    return estimate
+
+def submit_batch(client: OpenAI, requests: List[Dict], poll_seconds: int = 30) -> Dict[str, str]:
+    """Run Responses requests through the Batch API; returns custom_id -> output text.
+
+    `requests` is a list of {'custom_id': ..., 'body': {...}} entries. Batch runs
+    cost ~50% of real-time pricing and draw from a separate rate-limit pool.
+    """
+    lines = [json.dumps({'custom_id': r['custom_id'], 'method': 'POST',
+                         'url': '/v1/responses', 'body': r['body']}, ensure_ascii=False)
+             for r in requests]
+    payload = ("\n".join(lines) + "\n").encode('utf-8')
+    batch_file = client.files.create(file=('batch_requests.jsonl', payload), purpose='batch')
+    batch = client.batches.create(input_file_id=batch_file.id,
+                                  endpoint='/v1/responses', completion_window='24h')
+    while batch.status not in ('completed', 'failed', 'expired', 'cancelled'):
+        time.sleep(poll_seconds)
+        batch = client.batches.retrieve(batch.id)
+    if batch.status != 'completed':
+        raise SystemExit(f"Batch {batch.id} ended with status: {batch.status}")
+
+    results: Dict[str, str] = {}
+    content = client.files.content(batch.output_file_id)
+    for line in content.text.splitlines():
+        if not line.strip():
+            continue
+        rec = json.loads(line)
+        body = (rec.get('response') or {}).get('body') or {}
+        texts = []
+        for item in body.get('output', []):
+            for part in item.get('content', []):
+                if part.get('type') == 'output_text':
+                    texts.append(part.get('text', ''))
+        results[rec.get('custom_id')] = "".join(texts)
+    return results
+
+def _call_one(client: OpenAI, model: str, body: str) -> str:
+    """Run one compile request with exponential backoff on rate limits."""
+    delay = 1.0
+    for attempt in range(6):
+        try:
+            resp = client.responses.create(
+                model=model,
+                instructions=DEFAULT_PROMPT,
+                input=[{"role":"user","content":[{"type":"input_text","text":body}]}],
+                temperature=0.2,
+            )
+            return resp.output_text
+        except RateLimitError:
+            if attempt == 5:
+                raise
+            time.sleep(delay + random.uniform(0, delay))
+            delay = min(delay * 2, 60)
+
+def run_compile(model: str, groups: Dict[str, List[Dict]], outdir: pathlib.Path,
+                concurrency: int = 8, use_batch: bool = False, bundle: bool = False):
+    client = OpenAI()
+    jobs = [(key, slugify(key), build_input_block(items))
+            for key, items in groups.items()]
+
+    if not bundle:
+        comp_dir = outdir / 'compilations'
+        snip_dir = outdir / 'snippets'
+        comp_dir.mkdir(exist_ok=True)
+        snip_dir.mkdir(exist_ok=True)
+
+    def write_group(slug: str, out_text: str):
+        sections = split_sections(out_text)
         (comp_dir / f"{slug}.md").write_text(sections.get('compilations','').strip()+"\n", encoding='utf-8')
         (snip_dir / f"{slug}.md").write_text(sections.get('snippets','').strip()+"\n", encoding='utf-8')
+
+    # Identical bodies (heavy tag overlap) would produce identical prompts —
+    # submit each unique body once and fan the result back out per group.
+    # Keyed by the group key, not the slug: slugs are lossy and distinct
+    # groups can slugify identically
+    body_hashes = {key: hashlib.blake2b(body.encode('utf-8'), digest_size=16).hexdigest()
+                   for key, slug, body in jobs}
+    unique_bodies: Dict[str, str] = {}
+    slugs_by_hash: Dict[str, List[str]] = defaultdict(list)
+    for key, slug, body in jobs:
+        unique_bodies.setdefault(body_hashes[key], body)
+        slugs_by_hash[body_hashes[key]].append(slug)
+
+    results: Dict[str, str] = {}
+    if use_batch:
+        # Pack every unique body into one Batch API submission (~50% cost, 24h window)
+        reqs = [{'custom_id': h,
+                 'body': {'model': model,
+                          'instructions': DEFAULT_PROMPT,
+                          'input': [{"role":"user","content":[{"type":"input_text","text":body}]}],
+                          'temperature': 0.2}}
+                for h, body in unique_bodies.items()]
+        by_hash = submit_batch(client, reqs)
+        for h, slugs in slugs_by_hash.items():
+            for slug in slugs:
+                if bundle:
+                    results[slug] = by_hash.get(h, '')
+                else:
+                    write_group(slug, by_hash.get(h, ''))
+    else:
+        # Groups are independent, so dispatch the (network-bound) calls in parallel
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as ex:
+            futures = {ex.submit(_call_one, client, model, body): h
+                       for h, body in unique_bodies.items()}
+            for fut in as_completed(futures):
+                out = fut.result()
+                for slug in slugs_by_hash[futures[fut]]:
+                    if bundle:
+                        results[slug] = out
+                    else:
+                        write_group(slug, out)
+
+    if bundle:
+        # Two large files with one write each instead of 2G small-file creations
+        comp_parts = ["# Compilations (GPT)\n"]
+        snip_parts = ["# Snippets (GPT)\n"]
+        for key, slug, _ in jobs:
+            sections = split_sections(results.get(slug, ''))
+            comp_parts.append(f"## {key}\n\n" + sections.get('compilations','').strip() + "\n")
+            snip_parts.append(f"## {key}\n\n" + sections.get('snippets','').strip() + "\n")
+        (outdir / 'compilations.md').write_bytes("\n".join(comp_parts).encode('utf-8'))
+        (outdir / 'snippets.md').write_bytes("\n".join(snip_parts).encode('utf-8'))
+
+        index_lines = ["# Quote Bundles (GPT)\n",
+                       "- [compilations.md](compilations.md)",
+                       "- [snippets.md](snippets.md)"]
+        (outdir / 'INDEX.md').write_text("\n".join(index_lines)+"\n", encoding='utf-8')
+        return
+
+    # Emit the index in group order so output stays deterministic
+    index_lines = ["# Quote Bundles (GPT)\n"]
+    for key, slug, _ in jobs:
         index_lines.append(f"- **{key}** → [compilations/{slug}.md](compilations/{slug}.md), [snippets/{slug}.md](snippets/{slug}.md)")
 
     (outdir / 'INDEX.md').write_text("\n".join(index_lines)+"\n", encoding='utf-8')
@@ -157,21 +371,25 @@ def main():
     ap.add_argument('-m','--model', default='gpt-5')
     ap.add_argument('-o','--outdir', required=True)
     ap.add_argument('--estimate-only', action='store_true')
+    ap.add_argument('--concurrency', type=int, default=8, help='parallel OpenAI requests')
+    ap.add_argument('--batch', action='store_true', help='submit all groups via the Batch API (~50%% cost, async turnaround)')
+    ap.add_argument('--bundle', action='store_true', help='write one compilations.md/snippets.md instead of per-group files')
     args = ap.parse_args()
 
     jsonl = pathlib.Path(args.input)
     outdir = pathlib.Path(args.outdir)
     outdir.mkdir(parents=True, exist_ok=True)
 
-    quotes = load_quotes(jsonl)
-    if not quotes:
-        raise SystemExit('No quotes found in JSONL.')
-
     groups: Dict[str, List[Dict]] = defaultdict(list)
-    for q in quotes:
+    for q in iter_quotes(jsonl):
         groups[group_key(q)].append(q)
+    if not groups:
+        raise SystemExit('No quotes found in JSONL.')
 
-    estimate = estimate_tokens_and_cost(args.model, groups, DEFAULT_PROMPT)
+    # Sidecar token cache lives next to the input JSONL so re-runs only
+    # tokenize quotes added since the last estimate
+    estimate = estimate_tokens_and_cost(args.model, groups, DEFAULT_PROMPT,
+                                        cache_path=jsonl.parent / '.tokcache.json')
 
     # Write cost report file
     cost_path = pathlib.Path(args.outdir) / 'cost_report.json'
@@ -189,8 +407,12 @@ def main():
     else:
         print("Estimated cost: N/A (no rate for this model)")
 
-    run_compile(args.model, groups, outdir)
-    print(f"Wrote grouped outputs → {outdir / 'compilations'} and {outdir / 'snippets'}; index at {outdir / 'INDEX.md'}")
+    run_compile(args.model, groups, outdir, concurrency=args.concurrency,
+                use_batch=args.batch, bundle=args.bundle)
+    if args.bundle:
+        print(f"Wrote bundled outputs → {outdir / 'compilations.md'} and {outdir / 'snippets.md'}; index at {outdir / 'INDEX.md'}")
+    else:
+        print(f"Wrote grouped outputs → {outdir / 'compilations'} and {outdir / 'snippets'}; index at {outdir / 'INDEX.md'}")
 
 if __name__ == '__main__':
     main()
@@ -3,9 +3,23 @@
 
 import argparse, json, pathlib, re, difflib
 from typing import List, Dict
+from collections import defaultdict
 from dotenv import load_dotenv
 from openai import OpenAI
 
+# Try to import orjson for fast JSONL parsing
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+# Try to import rapidfuzz for fast fuzzy title matching (difflib fallback)
+try:
+    from rapidfuzz import fuzz as _rf_fuzz
+except ImportError:
+    _rf_fuzz = None
+
 DEFAULT_PROMPT = """
 ROLE: Product reconstructor.
 OBJECTIVE: From the quoted evidence below, infer distinct apps/tools that the author conceived, started, or partially built. DO NOT invent capabilities not suggested by the quotes.
@@ -25,74 +39,110 @@ Rules:
 - If evidence is thin, mark status "unknown".
 """.strip()
 
-def load_quotes(jsonl_path: pathlib.Path) -> List[dict]:
-    quotes = []
-    with open(jsonl_path, 'r', encoding='utf-8') as f:
+def iter_quotes(jsonl_path: pathlib.Path):
+    """Yield quote records one at a time without materializing the whole file."""
+    with open(jsonl_path, 'rb') as f:
         for line in f:
-            line = line.strip()
-            if not line:
+            if not line or line == b'\n':
                 continue
             try:
-                quotes.append(json.loads(line))
+                yield _json_loads(line)
             except Exception:
                 pass
-    return quotes
+
+def load_quotes(jsonl_path: pathlib.Path) -> List[dict]:
+    return list(iter_quotes(jsonl_path))
 
 def merge_similar_apps(apps, thresh=0.85):
     """Merge apps with similar titles using fuzzy matching."""
+    if _rf_fuzz is not None:
+        # rapidfuzz scores 0-100 in C; score_cutoff lets it bail out early
+        cutoff = thresh * 100
+        def is_similar(a, b):
+            return _rf_fuzz.ratio(a, b, score_cutoff=cutoff) >= cutoff
+    else:
+        def is_similar(a, b):
+            return difflib.SequenceMatcher(None, a, b).ratio() >= thresh
+
+    evidence_keys = ('evidence_pages','evidence_quotes','names_detected')
     merged = []
+    norms = []  # normalized title per merged entry, computed once
+    # Blocking: only score titles sharing a short prefix and a similar length —
+    # near-duplicates share most characters, so distant pairs never need scoring
+    buckets = defaultdict(list)  # (len(norm)//4, norm[:3]) -> merged indexes
     for app in apps:
         title = (app.get('title') or '').strip()
         if not title:
             merged.append(app)
+            norms.append(None)
             continue
         norm = re.sub(r'[^a-z0-9 ]+','', title.lower())
+        sig_len, sig_pre = len(norm) // 4, norm[:3]
         found = False
-        for m in merged:
-            mtitle = (m.get('title') or '')
-            mnorm = re.sub(r'[^a-z0-9 ]+','', mtitle.lower())
-            if difflib.SequenceMatcher(None, norm, mnorm).ratio() >= thresh:
-                # merge evidence fields
-                for k in ('evidence_pages','evidence_quotes','names_detected'):
-                    m[k] = sorted(set((m.get(k) or []) + (app.get(k) or [])))
-                found = True
+        for lb in (sig_len - 1, sig_len, sig_len + 1):
+            for idx in buckets.get((lb, sig_pre), ()):
+                if is_similar(norm, norms[idx]):
+                    # accumulate evidence into sets; sorted once after the loop
+                    m = merged[idx]
+                    for k in evidence_keys:
+                        m[k].update(app.get(k) or [])
+                    found = True
+                    break
+            if found:
                 break
         if not found:
+            for k in evidence_keys:
+                app[k] = set(app.get(k) or [])
+            buckets[(sig_len, sig_pre)].append(len(merged))
             merged.append(app)
+            norms.append(norm)
+
+    # materialize the evidence sets as sorted lists exactly once
+    for mnorm, m in zip(norms, merged):
+        if mnorm is not None:
+            for k in evidence_keys:
+                m[k] = sorted(m[k])
     return merged
 
-def run_apps_tools(model: str, quotes: List[Dict], outdir: pathlib.Path):
+def run_apps_tools(model: str, quotes: List[Dict], outdir: pathlib.Path, use_batch: bool = False):
     """Run apps & tools reconstruction."""
     client = OpenAI()
-    
+
     # Build input from quotes
     input_text = "\n\n".join([
         f"[p.{q.get('page_start', 0)}-{q.get('page_end', 0)}] {q.get('quote', '')}"
         for q in quotes
     ])
-    
-    prompt = DEFAULT_PROMPT + "\n\nEVIDENCE:\n\n" + input_text
-    
-    resp = client.responses.create(
-        model=model,
-        instructions=DEFAULT_PROMPT,
-        input=[{"role":"user","content":[{"type":"input_text","text":input_text}]}],
-        temperature=0.2,
-    )
-    
-    out = resp.output_text
-    
-    # Parse JSON response
+
+    if use_batch:
+        # Route the request through the Batch API (~50% cost, async turnaround)
+        try:
+            from scripts.parse_with_openai import submit_batch
+        except ImportError:
+            from parse_with_openai import submit_batch
+        req = {'custom_id': 'apps_tools',
+               'body': {'model': model,
+                        'instructions': DEFAULT_PROMPT,
+                        'input': [{"role":"user","content":[{"type":"input_text","text":input_text}]}],
+                        'temperature': 0.2,
+                        'text': {'format': {'type': 'json_object'}}}}
+        out = submit_batch(client, [req]).get('apps_tools', '')
+    else:
+        resp = client.responses.create(
+            model=model,
+            instructions=DEFAULT_PROMPT,
+            input=[{"role":"user","content":[{"type":"input_text","text":input_text}]}],
+            temperature=0.2,
+            text={'format': {'type': 'json_object'}},
+        )
+        out = resp.output_text
+
+    # JSON mode guarantees a parseable object; a failure here is an infra
+    # problem, not a formatting drift worth regex-salvaging
     try:
         data = json.loads(out)
-    except json.JSONDecodeError:
-        # Try to extract JSON from response
-        import re
-        json_match = re.search(r'\{.*\}', out, re.DOTALL)
-        if json_match:
-            data = json.loads(json_match.group(0))
-        else:
-            raise ValueError("Could not parse JSON from response")
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Could not parse JSON from response: {e}")
     
     # Deduplicate apps
     data['apps'] = merge_similar_apps(data.get('apps', []))
@@ -139,6 +189,7 @@ def main():
     ap.add_argument('-i','--input', required=True, help='scan_quotes.jsonl path')
     ap.add_argument('-m','--model', default='gpt-5')
     ap.add_argument('-o','--outdir', required=True)
+    ap.add_argument('--batch', action='store_true', help='submit via the Batch API (~50%% cost, async turnaround)')
     args = ap.parse_args()
 
     if not pathlib.Path(args.input).exists():
@@ -151,7 +202,7 @@ def main():
     if not quotes:
         raise SystemExit('No quotes found in JSONL.')
 
-    run_apps_tools(args.model, quotes, outdir)
+    run_apps_tools(args.model, quotes, outdir, use_batch=args.batch)
 
 if __name__ == '__main__':
     main()
@@ -1,9 +1,13 @@
-import os, json, argparse, pathlib, re, unicodedata, glob, csv
+import os, json, argparse, asyncio, functools, hashlib, pathlib, re, sqlite3, unicodedata, glob, csv
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from typing import List, Dict
-from tqdm import tqdm
-from pydantic import BaseModel
+from tqdm.asyncio import tqdm as atqdm
+from pydantic import BaseModel, TypeAdapter, ValidationError
 from dotenv import load_dotenv
-from openai import OpenAI
+import openai
+from openai import AsyncOpenAI
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter
 
 # Try to import ijson for streaming
 try:
@@ -11,6 +15,29 @@ try:
 except ImportError:
     ijson = None
 
+# Fast JSON for model-output parsing and JSONL writes (stdlib fallback)
+try:
+    import orjson
+    _json_loads = orjson.loads
+    def _json_dumps(obj) -> str:
+        return orjson.dumps(obj).decode('utf-8')
+except ImportError:
+    _json_loads = json.loads
+    def _json_dumps(obj) -> str:
+        return json.dumps(obj, ensure_ascii=False)
+
+# Optional: multi-pattern quote verification in one pass
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# Optional: client-side rate limiting for --rpm/--tpm
+try:
+    from aiolimiter import AsyncLimiter
+except ImportError:
+    AsyncLimiter = None
+
 CHARS_PER_CHUNK = 9000
 PSEUDO_PAGE_SIZE = 2500  # split long convs into page-sized slices
 
@@ -21,48 +48,119 @@ class Quote(BaseModel):
     tags: List[str]
     quote: str
 
+# Validates a whole quotes array in one call
+_QUOTE_LIST = TypeAdapter(List[Quote])
+
 SCAN_SYS_PROMPT = (pathlib.Path('prompts/scan_system.txt').read_text(encoding='utf-8')
                    if pathlib.Path('prompts/scan_system.txt').exists() else
                    "Return a JSON object with key 'quotes' -> array of {page_start,page_end,category,tags,quote}.")
 
+# Hot-path patterns, compiled once (normalize_text runs per quote per chunk)
+_WS_RE = re.compile(r"\s+")
+_CONV_RE = re.compile(r'\[CONV:\s*(.*?)\]')
+
+def _normalize(s: str) -> str:
+    # ASCII with no whitespace is already normal form — skip NFKC + regex
+    if s.isascii() and _WS_RE.search(s) is None:
+        return s
+    return _WS_RE.sub(" ", unicodedata.normalize('NFKC', s)).strip()
+
+_normalize_cached = functools.lru_cache(maxsize=4096)(_normalize)
+
 def normalize_text(s: str) -> str:
-    s = unicodedata.normalize('NFKC', s)
-    s = re.sub(r"\s+", " ", s)
-    return s.strip()
+    # Cache quote-sized strings only. Chunk texts also come through here
+    # (cache keys, chunk verification) and run to 64k chars under gpt-5
+    # sizing — caching those would pin ~0.5 GB of dead text in the LRU
+    return _normalize_cached(s) if len(s) <= 2048 else _normalize(s)
 
+@functools.lru_cache(maxsize=131072)
 def norm_key(s: str) -> str:
-    """Create normalized key for deduplication."""
-    return re.sub(r'\s+', ' ', normalize_text(s)).lower()
+    """Create normalized key for deduplication (cached — dupes recur across chunks)."""
+    return normalize_text(s).lower()
+
+def deduplicate_quotes(quotes: List[Dict], similarity_threshold: int = 5, _state=None) -> List[Dict]:
+    """Remove near-duplicate quotes based on normalized text similarity.
+
+    Pass `_state` (a (seen, buckets) pair) to dedup incrementally across
+    several calls — used by the streaming writer when --dedupe is on.
+    """
+    if _state is not None:
+        seen, buckets = _state
+    else:
+        seen = set()
+        # Near-dup candidates only need checking within the same cheap
+        # (length band, prefix) bucket — the threshold only allows a few
+        # chars of difference anyway
+        buckets = defaultdict(list)
+    unique_quotes = []
+
+    for quote in quotes:
+        normalized = norm_key(quote.get('quote', ''))
+        if not normalized:
+            continue
+
+        # Exact duplicates are the common case — O(1) set hit, no scan
+        if normalized in seen:
+            continue
+
+        # Check for near-duplicates within neighbouring length bands
+        band, prefix = len(normalized) // 8, normalized[:16]
+        is_duplicate = False
+        for b in (band - 1, band, band + 1):
+            for seen_text in buckets.get((b, prefix), ()):
+                if abs(len(normalized) - len(seen_text)) <= similarity_threshold:
+                    if normalized in seen_text or seen_text in normalized:
+                        is_duplicate = True
+                        break
+            if is_duplicate:
+                break
+
+        if not is_duplicate:
+            seen.add(normalized)
+            buckets[(band, prefix)].append(normalized)
+            unique_quotes.append(quote)
+
+    return unique_quotes
 
 # ----- Input loading -----
 
+def _text_from_dict_content(cont):
+    parts = cont.get('parts')
+    if isinstance(parts, list):
+        return "\n".join(p for p in parts if isinstance(p, str))
+    txt = cont.get('text')
+    if isinstance(txt, str):
+        return txt
+    if isinstance(txt, list):
+        return "\n".join([t.get('value') or t.get('text') or '' for t in txt if isinstance(t, dict)])
+    return None
+
+def _text_from_list_content(cont):
+    buf = []
+    for it in cont:
+        if isinstance(it, str):
+            buf.append(it)
+        elif isinstance(it, dict):
+            t = it.get('text') or it.get('value') or ''
+            if isinstance(t, str):
+                buf.append(t)
+    return "\n".join(buf) if buf else None
+
+# Dispatch on concrete content type — one dict lookup replaces the
+# isinstance chain in a loop that runs per message
+_CONTENT_DISPATCH = {'dict': _text_from_dict_content, 'list': _text_from_list_content}
+
 def _extract_message_text(msg: Dict) -> str:
     if not isinstance(msg, dict):
         return ''
     cont = msg.get('content')
 
     # common export shapes
-    if isinstance(cont, dict):
-        parts = cont.get('parts')
-        if isinstance(parts, list):
-            return "\n".join(p for p in parts if isinstance(p, str))
-        txt = cont.get('text')
-        if isinstance(txt, str):
-            return txt
-        if isinstance(txt, list):
-            return "\n".join([t.get('value') or t.get('text') or '' for t in txt if isinstance(t, dict)])
-
-    if isinstance(cont, list):
-        buf = []
-        for it in cont:
-            if isinstance(it, str):
-                buf.append(it)
-            elif isinstance(it, dict):
-                t = it.get('text') or it.get('value') or ''
-                if isinstance(t, str):
-                    buf.append(t)
-        if buf:
-            return "\n".join(buf)
+    fn = _CONTENT_DISPATCH.get(type(cont).__name__)
+    if fn is not None:
+        t = fn(cont)
+        if t is not None:
+            return t
 
     if isinstance(msg.get('text'), str):
         return msg['text']
@@ -74,16 +172,20 @@ def _extract_message_text(msg: Dict) -> str:
     return ''
 
 def stream_conversations(fp):
-    """Stream conversations from file, trying ijson first, fallback to json."""
+    """Stream conversations one at a time without building a full DOM."""
     if ijson is None:
-        data = json.load(fp)
-        return data if isinstance(data, list) else data.get('conversations', [])
-    # Try both top-level shapes
-    try:
-        return ijson.items(fp, 'item')  # list at top
-    except Exception:
-        fp.seek(0)
-        return ijson.items(fp, 'conversations.item')
+        raise SystemExit('ijson is required to stream large exports: pip install ijson')
+    # Peek at the first non-space byte to pick the top-level shape
+    b = fp.read(1)
+    while b and b.isspace():
+        b = fp.read(1)
+    fp.seek(0)
+    prefix = 'item' if b == b'[' else 'conversations.item'
+    return ijson.items(fp, prefix)
+
+def _load_pages_list(path: str, include_user=True, include_assistant=True) -> List[str]:
+    """Picklable wrapper for ProcessPoolExecutor (generators don't cross processes)."""
+    return list(load_pages_from_openai_json_one(path, include_user, include_assistant))
 
 def iter_inputs(path: str):
     """Iterate over input files - single file or directory."""
@@ -94,10 +196,9 @@ def iter_inputs(path: str):
     else:
         yield path
 
-def load_pages_from_openai_json_one(path: str, include_user=True, include_assistant=True) -> List[str]:
-    """Load pages from a single JSON file with role filtering."""
-    pages = []
-    with open(path, 'r', encoding='utf-8') as fp:
+def load_pages_from_openai_json_one(path: str, include_user=True, include_assistant=True):
+    """Yield pages from a single JSON file with role filtering (streaming)."""
+    with open(path, 'rb') as fp:
         for conv in stream_conversations(fp):
             title = conv.get('title') or 'Conversation'
             texts = []
@@ -125,66 +226,292 @@ def load_pages_from_openai_json_one(path: str, include_user=True, include_assist
             header = f"[CONV: {title}]\n"
             full = header + "\n\n".join(texts)
             for off in range(0, len(full), PSEUDO_PAGE_SIZE):
-                pages.append(full[off:off+PSEUDO_PAGE_SIZE])
-    return pages
+                yield full[off:off+PSEUDO_PAGE_SIZE]
 
 # ----- Chunking -----
 
-def chunk_pages(pages: List[str], chars_per_chunk=CHARS_PER_CHUNK):
-    chunks = []
-    buf, start_page = "", 1
+# Rough context windows (tokens) for sizing chunks; chars ≈ 4·tokens
+MODEL_CONTEXT = {
+    'gpt-5': 400_000, 'gpt-5-mini': 400_000, 'gpt-5-nano': 400_000,
+    'gpt-4.1': 1_000_000, 'gpt-4.1-mini': 1_000_000,
+    'gpt-4o': 128_000, 'gpt-4o-mini': 128_000,
+}
+
+def chars_per_chunk_for(model: str) -> int:
+    """Size chunks to the model instead of the hardcoded 9000 chars.
+
+    Every request carries fixed HTTP/model overhead, so under-full chunks
+    waste round-trips. Capped at 16k input tokens — far below any context
+    window — because giant chunks hurt quote recall and make retries
+    expensive. Unknown models keep the old default.
+    """
+    ctx = MODEL_CONTEXT.get(model)
+    if not ctx:
+        return CHARS_PER_CHUNK
+    reserve_out = 8000  # room for the response
+    prompt_toks = len(SCAN_SYS_PROMPT) // 4
+    target_toks = min(ctx - reserve_out - prompt_toks, 16_000)
+    return max(CHARS_PER_CHUNK, target_toks * 4)
+
+def chunk_pages(pages, chars_per_chunk=CHARS_PER_CHUNK):
+    """Yield (start_page, end_page, text) chunks from any iterable of pages.
+
+    Streaming: pages from the ijson loader flow straight through without
+    ever materializing the whole page list.
+    """
+    # list+join accumulation — `buf += piece` can go quadratic on CPython
+    buf_parts, buf_len, start_page, i = [], 0, 1, 0
     for i, text in enumerate(pages, start=1):
         text = text or ''
-        if len(buf) + len(text) > chars_per_chunk and buf:
-            chunks.append((start_page, i-1, buf))
-            buf, start_page = "", i
-        buf += f"\n\n[p.{i}]\n" + text
-    if buf:
-        chunks.append((start_page, len(pages), buf))
-    return chunks
+        if buf_len + len(text) > chars_per_chunk and buf_parts:
+            yield (start_page, i-1, "".join(buf_parts))
+            buf_parts, buf_len, start_page = [], 0, i
+        piece = f"\n\n[p.{i}]\n{text}"
+        buf_parts.append(piece)
+        buf_len += len(piece)
+    if buf_parts:
+        yield (start_page, i, "".join(buf_parts))
 
 # ----- OpenAI call -----
 
-def extract_quotes(client: OpenAI, model: str, chunk_text: str, p_start: int, p_end: int) -> List[Dict]:
-    instr = SCAN_SYS_PROMPT + f"\nChunk pages: {p_start}-{p_end}. Output ONLY the JSON object."
-    resp = client.responses.create(
-        model=model,
-        instructions=instr,
-        input=[{"role":"user","content":[{"type":"input_text","text":chunk_text}]}],
-        temperature=0.1,
-    )
-    txt = resp.output_text
+def make_async_client() -> AsyncOpenAI:
+    """Build AsyncOpenAI on an aiohttp transport when available.
+
+    httpx's default pool degrades once dozens of requests are in flight;
+    the aiohttp client (pip install 'openai[aiohttp]') keeps throughput
+    flat. Fall back to a widened httpx pool, then to SDK defaults.
+    """
+    try:
+        from openai import DefaultAioHttpClient
+        return AsyncOpenAI(http_client=DefaultAioHttpClient())
+    except Exception:
+        pass
+    try:
+        import httpx
+        from openai import DefaultAsyncHttpxClient
+        return AsyncOpenAI(http_client=DefaultAsyncHttpxClient(
+            limits=httpx.Limits(max_connections=256, max_keepalive_connections=256),
+            timeout=60))
+    except Exception:
+        return AsyncOpenAI()
+
+def open_response_cache(path) -> sqlite3.Connection:
+    """On-disk cache of raw model responses keyed by (model, prompt, chunk)."""
+    db = sqlite3.connect(path)
+    db.execute('CREATE TABLE IF NOT EXISTS cache (k TEXT PRIMARY KEY, resp TEXT)')
+    return db
+
+def _cache_key(model: str, chunk_text: str) -> str:
+    # Normalized chunk text so whitespace-only variations hit the same row
+    return hashlib.sha256((model + SCAN_SYS_PROMPT + normalize_text(chunk_text)).encode('utf-8')).hexdigest()
+
+def chunk_instructions(p_start: int, p_end: int) -> str:
+    return SCAN_SYS_PROMPT + f"\nChunk pages: {p_start}-{p_end}. Output ONLY the JSON object."
+
+def parse_quotes(txt: str, chunk_text: str, p_start: int, p_end: int) -> List[Dict]:
+    """Parse model output into verified quote records (shared by both call paths)."""
     records = []
     try:
-        obj = json.loads(txt)
-        for item in obj.get('quotes', []):
-            try:
-                q = Quote(**item).model_dump()
-                records.append(q)
-            except Exception:
-                continue
+        obj = _json_loads(txt)
+        items = obj.get('quotes', [])
+        try:
+            # Validate the whole array in one pass — cheaper than N model
+            # constructions when the response is well-formed
+            records = [q.model_dump() for q in _QUOTE_LIST.validate_python(items)]
+        except ValidationError:
+            # One bad item shouldn't drop the batch; fall back to per-item
+            for item in items:
+                try:
+                    q = Quote(**item).model_dump()
+                    records.append(q)
+                except Exception:
+                    continue
     except Exception:
         # loose fallback
         for line in txt.splitlines():
             line = line.strip()
             if line.startswith('{') and line.endswith('}'):
                 try:
-                    q = Quote(**json.loads(line)).model_dump()
+                    q = Quote(**_json_loads(line)).model_dump()
                     records.append(q)
                 except Exception:
                     pass
 
-    # Verify each quote is verbatim in the chunk (no hallucinations)
-    norm_chunk = normalize_text(chunk_text)
+    # Verify each quote is verbatim in the chunk (no hallucinations).
+    # Raw containment is the common case; quotes that fail it get one
+    # normalized multi-pattern pass over the chunk instead of Q rescans.
+    pending = []
+    ok_ids = set()
+    for r in records:
+        q = r['quote']
+        if q and q in chunk_text:
+            ok_ids.add(id(r))
+        elif q:
+            pending.append(r)
+    if pending:
+        norm_chunk = normalize_text(chunk_text)
+        pairs = [(normalize_text(r['quote']), r) for r in pending]
+        patterns = {qn for qn, _ in pairs if qn}
+        if ahocorasick is not None and len(patterns) > 2:
+            # Aho-Corasick finds all (overlapping) needles in one O(|chunk|) scan
+            A = ahocorasick.Automaton()
+            for qn in patterns:
+                A.add_word(qn, qn)
+            A.make_automaton()
+            found = {val for _, val in A.iter(norm_chunk)}
+        else:
+            found = {qn for qn in patterns if qn in norm_chunk}
+        for qn, r in pairs:
+            if qn in found:
+                ok_ids.add(id(r))
     verified = []
     for r in records:
-        qnorm = normalize_text(r['quote'])
-        if qnorm and qnorm in norm_chunk:
+        if id(r) in ok_ids:
             r['page_start'] = max(p_start, int(r['page_start']))
             r['page_end'] = min(p_end, int(r['page_end']))
             verified.append(r)
     return verified
 
+# Transient failures (429s, timeouts, 5xx) shouldn't kill a long scan;
+# back off with jitter and retry a few times before giving up
+_RETRYABLE = (openai.RateLimitError, openai.APITimeoutError,
+              openai.APIConnectionError, openai.InternalServerError)
+
+@retry(wait=wait_exponential_jitter(1, 60), stop=stop_after_attempt(6),
+       retry=retry_if_exception_type(_RETRYABLE), reraise=True)
+async def _create_with_retry(client: AsyncOpenAI, **kw):
+    return await client.responses.create(**kw)
+
+async def extract_quotes(client: AsyncOpenAI, model: str, chunk_text: str, p_start: int, p_end: int,
+                         cache: sqlite3.Connection = None) -> List[Dict]:
+    txt = None
+    if cache is not None:
+        key = _cache_key(model, chunk_text)
+        row = cache.execute('SELECT resp FROM cache WHERE k=?', (key,)).fetchone()
+        if row:
+            txt = row[0]
+    if txt is None:
+        resp = await _create_with_retry(client,
+            model=model,
+            instructions=chunk_instructions(p_start, p_end),
+            input=[{"role":"user","content":[{"type":"input_text","text":chunk_text}]}],
+            temperature=0.1,
+        )
+        txt = resp.output_text
+        if cache is not None:
+            cache.execute('INSERT OR REPLACE INTO cache VALUES (?, ?)', (key, txt))
+            cache.commit()
+    # Verification always runs, cached or not
+    return parse_quotes(txt, chunk_text, p_start, p_end)
+
+def scan_chunks_batch(model: str, chunks) -> List[tuple]:
+    """Run every chunk through the Batch API; returns (text, recs) in chunk order.
+
+    Half-price and a separate rate-limit pool — the right mode for
+    non-interactive scans of a whole export.
+    """
+    from openai import OpenAI
+    try:
+        from scripts.parse_with_openai import submit_batch
+    except ImportError:
+        from parse_with_openai import submit_batch
+    chunks = list(chunks)  # iterated twice: request build + result join
+    reqs = [{'custom_id': f'c{i}',
+             'body': {'model': model,
+                      'instructions': chunk_instructions(p_start, p_end),
+                      'input': [{"role":"user","content":[{"type":"input_text","text":text}]}],
+                      'temperature': 0.1}}
+            for i, (p_start, p_end, text) in enumerate(chunks)]
+    outputs = submit_batch(OpenAI(), reqs)
+    return [(text, parse_quotes(outputs.get(f'c{i}', ''), text, p_start, p_end))
+            for i, (p_start, p_end, text) in enumerate(chunks)]
+
+async def scan_async(args, include_user: bool, include_assistant: bool,
+                     jsonl_path: pathlib.Path, csv_path: pathlib.Path):
+    client = make_async_client()
+    # Chunks are independent; keep many requests in flight, bounded so we
+    # don't slam the account's rate limit
+    sem = asyncio.Semaphore(getattr(args, 'concurrency', None)
+                            or int(os.getenv('OAI_CONCURRENCY', '32')))
+    seen = set()
+    # Optional near-dup filtering on top of the exact-key dedup below
+    dedupe_state = (set(), defaultdict(list)) if getattr(args, 'dedupe', False) else None
+
+    failed_path = jsonl_path.with_name(jsonl_path.stem + '.failed.jsonl')
+    # Re-runs (and repeated boilerplate chunks) skip the API entirely
+    cache = open_response_cache(jsonl_path.parent / 'cache.sqlite')
+
+    # Token buckets sized to the account's limits keep us just under the
+    # 429 wall instead of slamming into it and paying long backoffs
+    rpm, tpm = getattr(args, 'rpm', 0), getattr(args, 'tpm', 0)
+    if (rpm or tpm) and AsyncLimiter is None:
+        raise SystemExit('--rpm/--tpm need aiolimiter: pip install aiolimiter')
+    rpm_lim = AsyncLimiter(rpm, 60) if rpm else None
+    tpm_lim = AsyncLimiter(tpm, 60) if tpm else None
+
+    async def run_chunk(p_start: int, p_end: int, text: str):
+        try:
+            async with sem:
+                if rpm_lim is not None:
+                    await rpm_lim.acquire()
+                if tpm_lim is not None:
+                    # rough chars/4 token estimate for the chunk payload
+                    await tpm_lim.acquire(min(len(text) // 4 + 200, tpm))
+                recs = await extract_quotes(client, args.model, text, p_start, p_end, cache=cache)
+        except Exception as e:
+            # Log the chunk for a later retry run instead of losing the scan
+            with open(failed_path, 'a', encoding='utf-8') as ff:
+                ff.write(_json_dumps({'page_start': p_start, 'page_end': p_end,
+                                      'error': str(e)}) + '\n')
+            print(f"Chunk p.{p_start}-{p_end} failed after retries: {e}")
+            recs = []
+        return text, recs
+
+    with open(jsonl_path, 'w', encoding='utf-8') as jf, open(csv_path, 'w', newline='', encoding='utf-8') as cf:
+        cw = csv.writer(cf)
+        cw.writerow(['page_start','page_end','category','top_tag','preview','conversation'])
+
+        async def scan_one(inp, pages):
+            chunks = chunk_pages(pages, chars_per_chunk_for(args.model))
+            if getattr(args, 'batch', False):
+                chunks = list(chunks)
+                print(f"Submitting {len(chunks)} chunks from {os.path.basename(inp)} to the Batch API...")
+                results = await asyncio.to_thread(scan_chunks_batch, args.model, chunks)
+            else:
+                tasks = [run_chunk(p_start, p_end, text) for p_start, p_end, text in chunks]
+                # gather keeps chunk order, so dedup stays deterministic
+                results = await atqdm.gather(*tasks, desc=f'Scanning {os.path.basename(inp)}')
+            for text, recs in results:
+                conv_match = _CONV_RE.search(text)
+                conv_title = conv_match.group(1).strip() if conv_match else ''
+                if dedupe_state is not None:
+                    recs = deduplicate_quotes(recs, getattr(args, 'dedupe_threshold', 5),
+                                              _state=dedupe_state)
+                for r in recs:
+                    key = norm_key(r['quote'])
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    r_out = dict(r); r_out['conversation'] = conv_title  # keep convo label
+                    jf.write(_json_dumps(r_out) + '\n')
+                    cw.writerow([r['page_start'], r['page_end'], r.get('category',''),
+                                 (r.get('tags') or [''])[0], r['quote'][:80].replace('\n',' '), conv_title])
+
+        inputs = list(iter_inputs(args.input))
+        if len(inputs) > 1:
+            # JSON parse is CPU-bound and the GIL blocks threads, so fan
+            # file loading out across cores. One file's pages sit in RAM at
+            # a time; the single-file path below stays fully streaming.
+            loader = functools.partial(_load_pages_list,
+                                       include_user=include_user,
+                                       include_assistant=include_assistant)
+            with ProcessPoolExecutor(max_workers=min(len(inputs), os.cpu_count() or 1)) as pool:
+                for inp, pages in zip(inputs, pool.map(loader, inputs)):
+                    await scan_one(inp, pages)
+        else:
+            for inp in inputs:
+                await scan_one(inp, load_pages_from_openai_json_one(inp, include_user, include_assistant))
+
 def main():
     load_dotenv()
     ap = argparse.ArgumentParser()
@@ -192,8 +519,14 @@ def main():
     ap.add_argument('-o','--outdir', required=True, help='Output directory')
     ap.add_argument('-m','--model', default=os.getenv('OPENAI_MODEL','gpt-5'))
     ap.add_argument('--roles', choices=['both','user','assistant'], default='both')
+    ap.add_argument('--batch', action='store_true', help='Submit chunks via the Batch API (~50%% cheaper, up to 24h)')
+    ap.add_argument('--rpm', type=int, default=int(os.getenv('OAI_RPM', '0')), help='Client-side requests/minute cap (0 = off)')
+    ap.add_argument('--tpm', type=int, default=int(os.getenv('OAI_TPM', '0')), help='Client-side input tokens/minute cap (0 = off)')
+    ap.add_argument('--concurrency', type=int, default=int(os.getenv('OAI_CONCURRENCY', '32')), help='Max requests in flight')
+    ap.add_argument('--dedupe', action='store_true', help='Also drop near-duplicate quotes (exact dupes always go)')
+    ap.add_argument('--dedupe-threshold', type=int, default=5, help='Char-length window for near-duplicate detection')
     args = ap.parse_args()
-    
+
     include_user = args.roles in ('both','user')
     include_assistant = args.roles in ('both','assistant')
 
@@ -203,31 +536,9 @@ def main():
     outdir = pathlib.Path(args.outdir)
     outdir.mkdir(parents=True, exist_ok=True)
     jsonl_path = outdir / 'scan_quotes.jsonl'
-
-    client = OpenAI()
-    seen = set()
     csv_path = outdir / 'quotes_index.csv'
-    
-    with open(jsonl_path, 'w', encoding='utf-8') as jf, open(csv_path, 'w', newline='', encoding='utf-8') as cf:
-        cw = csv.writer(cf)
-        cw.writerow(['page_start','page_end','category','top_tag','preview','conversation'])
 
-        for inp in iter_inputs(args.input):
-            pages = load_pages_from_openai_json_one(inp, include_user, include_assistant)
-            chunks = chunk_pages(pages)
-            for p_start, p_end, text in tqdm(chunks, desc=f'Scanning {os.path.basename(inp)}'):
-                recs = extract_quotes(client, args.model, text, p_start, p_end)
-                conv_match = re.search(r'\[CONV:\s*(.*?)\]', text)
-                conv_title = conv_match.group(1).strip() if conv_match else ''
-                for r in recs:
-                    key = norm_key(r['quote'])
-                    if key in seen:
-                        continue
-                    seen.add(key)
-                    r_out = dict(r); r_out['conversation'] = conv_title  # keep convo label
-                    jf.write(json.dumps(r_out, ensure_ascii=False) + '\n')
-                    cw.writerow([r['page_start'], r['page_end'], r.get('category',''),
-                                 (r.get('tags') or [''])[0], r['quote'][:80].replace('\n',' '), conv_title])
+    asyncio.run(scan_async(args, include_user, include_assistant, jsonl_path, csv_path))
 
     print(f"Wrote verified quotes → {jsonl_path}")
     print(f"Wrote CSV index → {csv_path}")
@@ -1,10 +1,41 @@
-import os, json, argparse, math, pathlib, re, unicodedata
+import os, json, argparse, asyncio, functools, hashlib, math, pathlib, re, sqlite3, unicodedata
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from typing import List, Dict
 import pdfplumber
+# PyMuPDF is ~10x faster than pdfplumber for plain text extraction; fall
+# back to pdfplumber when it's not installed or when ordering differs
+try:
+    import fitz  # PyMuPDF
+except ImportError:
+    fitz = None
 from tqdm import tqdm
-from pydantic import BaseModel
+from pydantic import BaseModel, TypeAdapter, ValidationError
 from dotenv import load_dotenv
-from openai import OpenAI
+import openai
+from openai import AsyncOpenAI
+# Fast JSON parse/serialize where available; stdlib otherwise
+try:
+    import orjson
+    _json_loads = orjson.loads
+    def _json_dumps(obj) -> str:
+        return orjson.dumps(obj).decode('utf-8')
+except ImportError:
+    _json_loads = json.loads
+    def _json_dumps(obj) -> str:
+        return json.dumps(obj, ensure_ascii=False)
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+# Optional: multi-pattern quote verification in one pass
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+# Optional: ICU's table-driven NFKD beats unicodedata on big chunks
+try:
+    from icu import Normalizer2
+    _nfkd = Normalizer2.getNFKDInstance().normalize
+except ImportError:
+    _nfkd = functools.partial(unicodedata.normalize, 'NFKD')
 
 class Quote(BaseModel):
     page_start: int
@@ -13,74 +44,185 @@ class Quote(BaseModel):
     tags: List[str]
     quote: str
 
+# Validates a whole quotes array in one call
+_QUOTE_LIST = TypeAdapter(List[Quote])
+
 SCAN_SYS_PROMPT = (pathlib.Path('prompts/scan_system.txt').read_text(encoding='utf-8')
                    if pathlib.Path('prompts/scan_system.txt').exists() else
                    "You are a quote extractor. Output JSONL: {page_start,page_end,category,tags,quote}")
 
+def _quotes_schema() -> Dict:
+    # Strict mode requires every object to close over its properties
+    item = Quote.model_json_schema()
+    item['additionalProperties'] = False
+    return {"type": "object",
+            "properties": {"quotes": {"type": "array", "items": item}},
+            "required": ["quotes"], "additionalProperties": False}
+
+# Structured output spec: the model provably returns {"quotes":[Quote,...]},
+# so the loose parse fallbacks become dead weight on the happy path
+_QUOTES_FORMAT = {"format": {"type": "json_schema", "name": "quotes",
+                             "schema": _quotes_schema(), "strict": True}}
+
 CHARS_PER_CHUNK = 9000  # broad sweep to control token cost
+TOKENS_PER_CHUNK = 6000  # target when tiktoken can measure real token counts
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoder():
+    """Return a shared tiktoken encoder, or None when tiktoken is unavailable."""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        # tiktoken missing or unable to fetch its encoding data
+        return None
+
+
+def chunk_pages(pages: List[tuple], chars_per_chunk=CHARS_PER_CHUNK, enc=None):
+    """Yield chunks of roughly chars_per_chunk from (page_no, text) pairs.
 
+    Generator so the async scanner can start its first request as soon as
+    one chunk's worth of pages has parsed, instead of after the whole PDF.
+    Takes explicit page numbers so callers can drop blank pages without the
+    [p.N] headers drifting off the real PDF pagination. With a tiktoken
+    encoder, chunks are sized by real token counts (TOKENS_PER_CHUNK) instead
+    of the chars≈4·tokens heuristic, so dense text can't overshoot and prose
+    doesn't underfill.
+    """
+    measure = (lambda s: len(enc.encode(s))) if enc is not None else len
+    cap = TOKENS_PER_CHUNK if enc is not None else chars_per_chunk
+    # Accumulate page pieces and join once per chunk — repeated str += on a
+    # 9k buffer reallocates quadratically on builds without the concat fastpath
+    pieces, cur_len = [], 0
+    start_page = prev_page = None
+    for i, text in pages:
+        if start_page is None:
+            start_page = prev_page = i
+        # Measure the piece as sent (header included), and only once —
+        # the same count drives the overflow check and the running total
+        piece = f"\n\n[p.{i}]\n{text}"
+        piece_len = measure(piece)
+        if cur_len + piece_len > cap and pieces:
+            yield (start_page, prev_page, ''.join(pieces))
+            pieces, cur_len, start_page = [], 0, i
+        pieces.append(piece)
+        cur_len += piece_len
+        prev_page = i
+    if pieces:
+        yield (start_page, prev_page, ''.join(pieces))
 
-def chunk_pages(pages: List[str], chars_per_chunk=CHARS_PER_CHUNK):
-    chunks = []
-    buf, start_page = "", 1
-    for i, text in enumerate(pages, start=1):
-        if len(buf) + len(text) > chars_per_chunk and buf:
-            chunks.append((start_page, i-1, buf))
-            buf, start_page = "", i
-        buf += f"\n\n[p.{i}]\n" + text
-    if buf:
-        chunks.append((start_page, len(pages), buf))
-    return chunks
 
+_WS_RE = re.compile(r'\s+')
+# Flat {...} spans for the loose fallback parse (quote objects never nest)
+_OBJ_RE = re.compile(r'\{[^{}]*\}', re.S)
 
 def normalize_text(text: str) -> str:
     """Normalize text for comparison by removing extra whitespace and unicode variations."""
     if not text:
         return ""
     # Normalize unicode, remove extra whitespace, convert to lowercase
-    normalized = unicodedata.normalize('NFKD', text)
-    normalized = re.sub(r'\s+', ' ', normalized.strip().lower())
+    normalized = _nfkd(text)
+    normalized = _WS_RE.sub(' ', normalized.strip().lower())
     return normalized
 
-def extract_quotes(client: OpenAI, model: str, chunk_text: str, p_start: int, p_end: int) -> List[Dict]:
-    instr = SCAN_SYS_PROMPT + f"\nChunk pages: {p_start}-{p_end}. Return JSON object only."
-    resp = client.responses.create(
-        model=model,
-        instructions=instr,
-        input=[{"role":"user","content":[{"type":"input_text","text":chunk_text}]}],
-        # Keep it terse for cost
-        temperature=0.1
-    )
-    txt = resp.output_text
+def open_response_cache(path) -> sqlite3.Connection:
+    """On-disk cache of raw model responses keyed by (model, prompt, chunk)."""
+    db = sqlite3.connect(path)
+    db.execute('CREATE TABLE IF NOT EXISTS cache (k TEXT PRIMARY KEY, resp TEXT)')
+    return db
+
+def _cache_key(model: str, chunk_text: str) -> str:
+    # Normalized chunk text so whitespace-only variations hit the same row
+    return hashlib.sha256((model + SCAN_SYS_PROMPT + normalize_text(chunk_text)).encode('utf-8')).hexdigest()
+
+def chunk_input(p_start: int, p_end: int, chunk_text: str) -> str:
+    # The page range rides in the user message so `instructions` stays
+    # byte-identical across chunks — OpenAI's automatic prompt caching keys
+    # off the exact prefix, and a volatile suffix would defeat it
+    return f"Chunk pages: {p_start}-{p_end}.\n{chunk_text}"
+
+# Transient failures (429s, timeouts, 5xx) under high concurrency shouldn't
+# silently drop a chunk's quotes; back off and retry before giving up
+_RETRYABLE = (openai.RateLimitError, openai.APITimeoutError,
+              openai.APIConnectionError, openai.InternalServerError)
+
+@retry(wait=wait_random_exponential(min=1, max=30), stop=stop_after_attempt(5),
+       retry=retry_if_exception_type(_RETRYABLE), reraise=True)
+async def _create_with_retry(client: AsyncOpenAI, **kwargs):
+    return await client.responses.create(**kwargs)
+
+async def extract_quotes(client: AsyncOpenAI, model: str, chunk_text: str, p_start: int, p_end: int,
+                         cache: sqlite3.Connection = None) -> List[Dict]:
+    txt = None
+    if cache is not None:
+        key = _cache_key(model, chunk_text)
+        row = cache.execute('SELECT resp FROM cache WHERE k=?', (key,)).fetchone()
+        if row:
+            txt = row[0]
+    if txt is None:
+        resp = await _create_with_retry(
+            client,
+            model=model,
+            instructions=SCAN_SYS_PROMPT,
+            input=[{"role":"user","content":[{"type":"input_text","text":chunk_input(p_start, p_end, chunk_text)}]}],
+            text=_QUOTES_FORMAT,
+        )
+        txt = resp.output_text
+        if cache is not None:
+            cache.execute('INSERT OR REPLACE INTO cache VALUES (?, ?)', (key, txt))
+            cache.commit()
+    # Verification always runs, cached or not
+    return parse_quotes(txt, chunk_text, p_start, p_end)
+
+def parse_quotes(txt: str, chunk_text: str, p_start: int, p_end: int) -> List[Dict]:
     records = []
-    
+
     try:
         # Try to parse as single JSON object first
-        obj = json.loads(txt)
+        obj = _json_loads(txt)
         if 'quotes' in obj and isinstance(obj['quotes'], list):
-            for quote_data in obj['quotes']:
-                try:
-                    q = Quote(**quote_data)
-                    records.append(q.model_dump())
-                except Exception:
-                    pass
+            try:
+                # One pass through pydantic-core; with strict structured
+                # output this essentially never raises
+                records = [q.model_dump() for q in _QUOTE_LIST.validate_python(obj['quotes'])]
+            except ValidationError:
+                # one bad item shouldn't discard the good ones
+                for quote_data in obj['quotes']:
+                    try:
+                        records.append(Quote(**quote_data).model_dump())
+                    except Exception:
+                        pass
     except Exception:
-        # fallback: try line-by-line JSON if model deviates
-        for line in txt.splitlines():
-            line = line.strip()
-            if line.startswith('{') and line.endswith('}'):
-                try:
-                    q = Quote(**json.loads(line)).model_dump()
-                    records.append(q)
-                except Exception:
-                    pass
-
-    # Quote verification against the actual chunk to eliminate drift
+        # fallback: pull out any flat {...} spans if the model deviates
+        # (handles JSONL, prose-wrapped objects, trailing commentary alike)
+        for m in _OBJ_RE.finditer(txt):
+            try:
+                q = Quote(**_json_loads(m.group())).model_dump()
+                records.append(q)
+            except Exception:
+                pass
+
+    # Quote verification against the actual chunk to eliminate drift.
+    # Skip the full-chunk NFKD pass entirely when there's nothing to verify.
+    if not records:
+        return []
     norm_chunk = normalize_text(chunk_text)
+    pairs = [(normalize_text(r['quote']), r) for r in records]
+    patterns = {qn for qn, _ in pairs if qn}
+    if ahocorasick is not None and len(patterns) > 2:
+        # Aho-Corasick finds all (overlapping) needles in one O(|chunk|) scan
+        # instead of one substring search per quote
+        A = ahocorasick.Automaton()
+        for qn in patterns:
+            A.add_word(qn, qn)
+        A.make_automaton()
+        found = {val for _, val in A.iter(norm_chunk)}
+    else:
+        found = {qn for qn in patterns if qn in norm_chunk}
     verified = []
-    for r in records:
-        qnorm = normalize_text(r['quote'])
-        if qnorm and qnorm in norm_chunk:
+    for qnorm, r in pairs:
+        if qnorm in found:
             # Clamp page range to this chunk's declared bounds
             r['page_start'] = max(p_start, int(r['page_start']))
             r['page_end'] = min(p_end, int(r['page_end']))
@@ -88,12 +230,101 @@ def extract_quotes(client: OpenAI, model: str, chunk_text: str, p_start: int, p_
     return verified
 
 
+def _extract_page_span(path: str, lo: int, hi: int) -> List[str]:
+    """Worker: extract text for pages [lo, hi). Opens its own document so it
+    can run in a separate process (fitz handles don't pickle)."""
+    doc = fitz.open(path)
+    try:
+        return [doc.load_page(i).get_text("text") or '' for i in range(lo, hi)]
+    finally:
+        doc.close()
+
+def iter_pages(path: str, parser: str = 'auto', min_page_chars: int = 0):
+    """Yield (page_no, text) one page at a time, skipping short/empty pages.
+
+    Streaming counterpart to extract_pages for the pipeline path: the LLM
+    pool starts consuming chunks while later pages are still parsing.
+    """
+    if parser == 'auto':
+        parser = 'pymupdf' if fitz is not None else 'pdfplumber'
+    if parser == 'pymupdf':
+        if fitz is None:
+            raise SystemExit('PyMuPDF not installed; pip install pymupdf or use --parser=pdfplumber')
+        doc = fitz.open(path)
+        try:
+            for i in range(doc.page_count):
+                t = doc.load_page(i).get_text("text") or ''
+                if len(t.strip()) >= min_page_chars:
+                    yield i + 1, t
+        finally:
+            doc.close()
+    else:
+        with pdfplumber.open(path) as pdf:
+            for i, p in enumerate(pdf.pages, start=1):
+                t = p.extract_text() or ''
+                if len(t.strip()) >= min_page_chars:
+                    yield i, t
+
+
+def extract_pages(path: str, parser: str = 'auto') -> List[str]:
+    """Extract per-page text. We only need raw text (no tables/layout), so
+    PyMuPDF is preferred when available."""
+    if parser == 'auto':
+        parser = 'pymupdf' if fitz is not None else 'pdfplumber'
+    if parser == 'pymupdf':
+        if fitz is None:
+            raise SystemExit('PyMuPDF not installed; pip install pymupdf or use --parser=pdfplumber')
+        n = fitz.open(path).page_count
+        workers = min(os.cpu_count() or 1, max(1, n // 16))
+        if workers > 1:
+            # Parsing is CPU-bound pure-extraction work and pages are
+            # independent; one contiguous span per worker keeps each process
+            # to a single document open instead of one per page
+            bounds = [round(n * w / workers) for w in range(workers + 1)]
+            with ProcessPoolExecutor(max_workers=workers) as ex:
+                spans = ex.map(_extract_page_span, [path] * workers,
+                               bounds[:-1], bounds[1:])
+                return [t for span in spans for t in span]
+        return _extract_page_span(path, 0, n)
+    with pdfplumber.open(path) as pdf:
+        return [(p.extract_text() or '') for p in pdf.pages]
+
+
+def scan_chunks_batch(model: str, chunks) -> List[List[Dict]]:
+    """Run every chunk through the Batch API; returns record lists in chunk order.
+
+    Half-price and a separate rate-limit pool, at the cost of up-to-24h
+    turnaround — the right trade for large PDFs nobody is waiting on.
+    """
+    from openai import OpenAI
+    try:
+        from scripts.parse_with_openai import submit_batch
+    except ImportError:
+        from parse_with_openai import submit_batch
+    reqs = [{'custom_id': f'chunk-{i}',
+             'body': {'model': model,
+                      'instructions': SCAN_SYS_PROMPT,
+                      'input': [{"role":"user","content":[{"type":"input_text","text":chunk_input(p_start, p_end, text)}]}],
+                      'text': _QUOTES_FORMAT}}
+            for i, (p_start, p_end, text) in enumerate(chunks)]
+    outputs = submit_batch(OpenAI(), reqs)
+    return [parse_quotes(outputs.get(f'chunk-{i}', ''), text, p_start, p_end)
+            for i, (p_start, p_end, text) in enumerate(chunks)]
+
+
 def main():
     load_dotenv()
     ap = argparse.ArgumentParser()
     ap.add_argument('-i','--input', required=True, help='PDF file path')
     ap.add_argument('-o','--outdir', required=True, help='Output directory')
     ap.add_argument('-m','--model', default=os.getenv('OPENAI_MODEL','gpt-5'))
+    ap.add_argument('--batch', action='store_true',
+                    help='Use the Batch API (~50%% cheaper, up to 24h turnaround)')
+    ap.add_argument('--parser', default='auto', choices=['auto','pymupdf','pdfplumber'],
+                    help='PDF text extractor (auto prefers PyMuPDF when installed)')
+    ap.add_argument('--min-page-chars', type=int, default=20,
+                    help='Skip pages with fewer stripped chars than this '
+                         '(image-only pages and header/footer stubs waste tokens)')
     args = ap.parse_args()
 
     api_key = os.getenv('OPENAI_API_KEY')
@@ -104,21 +335,73 @@ def main():
     outdir.mkdir(parents=True, exist_ok=True)
     jsonl_path = outdir / 'scan_quotes.jsonl'
 
-    with pdfplumber.open(args.input) as pdf:
-        pages_text = [ (p.extract_text() or '') for p in pdf.pages ]
+    if args.batch:
+        # Batch needs every request upfront anyway, so parse eagerly
+        # (extract_pages fans out across cores for large PDFs)
+        pages_text = extract_pages(args.input, args.parser)
+        # Image-only pages come back empty; don't pay tokens for bare [p.N] headers
+        pages = [(i, t) for i, t in enumerate(pages_text, start=1)
+                 if len(t.strip()) >= args.min_page_chars]
+        if len(pages) < len(pages_text):
+            print(f"Skipping {len(pages_text) - len(pages)} page(s) under {args.min_page_chars} chars")
+        chunks = list(chunk_pages(pages, enc=get_encoder()))
+        print(f"Submitting {len(chunks)} chunks via Batch API...")
+        kept_total = 0
+        with open(jsonl_path, 'w', encoding='utf-8', buffering=1<<20) as f:
+            for recs in scan_chunks_batch(args.model, chunks):
+                f.write(''.join(_json_dumps(r) + '\n' for r in recs))
+                kept_total += len(recs)
+    else:
+        # Pipeline: pages parse in a worker thread while the LLM pool is
+        # already scanning earlier chunks — wall time ≈ max(parse, LLM)
+        chunks = chunk_pages(iter_pages(args.input, args.parser, args.min_page_chars),
+                             enc=get_encoder())
+        kept_total = asyncio.run(scan_async(args.model, chunks, jsonl_path))
+    print(f"Wrote {kept_total} verified quotes → {jsonl_path}")
+
+
+async def scan_async(model: str, chunks, jsonl_path: pathlib.Path) -> int:
+    # Chunk requests are network-bound, so fire them concurrently under a
+    # semaphore; awaiting tasks in submission order keeps the JSONL stable
+    # while all requests stay in flight.
+    client = AsyncOpenAI()
+    concurrency = int(os.getenv('OPENAI_CONCURRENCY', '16'))
+    sem = asyncio.Semaphore(concurrency)
+    # Re-scans of an edited PDF (and repeated boilerplate chunks) hit the
+    # cache instead of paying for the same completion twice
+    cache = open_response_cache(jsonl_path.parent / 'cache.sqlite')
 
-    chunks = chunk_pages(pages_text)
-    client = OpenAI()
+    async def scan_chunk(p_start, p_end, text):
+        async with sem:
+            return await extract_quotes(client, model, text, p_start, p_end, cache=cache)
 
+    # Pull chunks off a worker thread so page parsing (sync, CPU-bound)
+    # overlaps with requests already in flight; the first request fires as
+    # soon as the first chunk exists. The task window is bounded so a
+    # 5000-page PDF never holds every chunk's text in RAM at once —
+    # memory stays O(window · chunk_size) regardless of document size.
+    chunk_iter = iter(chunks)
+    tasks = deque()
     kept_total = 0
-    with open(jsonl_path, 'w', encoding='utf-8') as f:
-        for p_start, p_end, text in tqdm(chunks, desc='Scanning'):
-            recs = extract_quotes(client, args.model, text, p_start, p_end)
-            for r in recs:
-                f.write(json.dumps(r, ensure_ascii=False) + '\n')
+    pbar = tqdm(desc='Scanning', unit='chunk')
+    # One buffered write per chunk instead of one small write per record
+    with open(jsonl_path, 'w', encoding='utf-8', buffering=1<<20) as f:
+
+        async def drain_oldest():
+            nonlocal kept_total
+            recs = await tasks.popleft()
+            f.write(''.join(_json_dumps(r) + '\n' for r in recs))
             kept_total += len(recs)
+            pbar.update(1)
 
-    print(f"Wrote {kept_total} verified quotes → {jsonl_path}")
+        while (c := await asyncio.to_thread(next, chunk_iter, None)) is not None:
+            tasks.append(asyncio.create_task(scan_chunk(*c)))
+            if len(tasks) >= concurrency * 4:
+                await drain_oldest()
+        while tasks:
+            await drain_oldest()
+    pbar.close()
+    return kept_total
 
 if __name__ == '__main__':
     main()